@@ -53,6 +53,7 @@ setup(
     # Optional dependencies
     extras_require={
         "google": ["aiohttp-oauthlib"],
+        "orjson": ["orjson"],
     },
     # Other
     packages=find_packages(exclude=["tests.*", "tests"]),
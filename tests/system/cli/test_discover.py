@@ -6,6 +6,7 @@ from textwrap import dedent
 import pytest
 
 from vdirsyncer import exceptions
+from vdirsyncer.cli.utils import load_status
 from vdirsyncer.storage.base import Storage
 
 
@@ -63,7 +64,8 @@ def test_discover_command(tmpdir, runner):
 
     # Check for redundant data that is already in the config. This avoids
     # copying passwords from the config too.
-    assert "fileext" not in tmpdir.join("status").join("foobar.collections").read()
+    status = load_status(str(tmpdir.join("status")), "foobar", data_type="collections")
+    assert "fileext" not in json.dumps(status)
 
 
 def test_discover_different_collection_names(tmpdir, runner):
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import json
 from textwrap import dedent
 
+from vdirsyncer.cli.utils import load_status
+
 
 def test_get_password_from_command(tmpdir, runner):
     runner.write_with_general(
@@ -36,7 +39,9 @@ def test_get_password_from_command(tmpdir, runner):
 
     result = runner.invoke(["discover"], input=".asdf\n")
     assert not result.exception
-    status = tmpdir.join("status").join("foobar.collections").read()
+    status = json.dumps(
+        load_status(str(tmpdir.join("status")), "foobar", data_type="collections")
+    )
     assert "foo" in status
     assert "bar" in status
     assert "asdf" not in status
@@ -1,11 +1,21 @@
 from __future__ import annotations
 
+import json
+import math
+import os
+
 import pytest
 
 from vdirsyncer import exceptions
+from vdirsyncer.cli import utils
+from vdirsyncer.cli.utils import get_status_path
 from vdirsyncer.cli.utils import handle_cli_error
+from vdirsyncer.cli.utils import load_status
+from vdirsyncer.cli.utils import manage_sync_status
+from vdirsyncer.cli.utils import save_status
 from vdirsyncer.cli.utils import storage_instance_from_config
 from vdirsyncer.cli.utils import storage_names
+from vdirsyncer.sync.status import SqliteKeyValueStatus
 
 
 def test_handle_cli_error(capsys):
@@ -19,6 +29,30 @@ def test_handle_cli_error(capsys):
     assert "ayy lmao" in err
 
 
+def test_handle_cli_error_explicit_exception(capsys):
+    handle_cli_error("foo/bar", RuntimeError("ayy lmao"))
+
+    out, err = capsys.readouterr()
+    assert "Unknown error occurred for foo/bar: ayy lmao" in err
+
+
+def test_handle_cli_error_subclass(capsys):
+    class MyUserError(exceptions.UserError):
+        pass
+
+    handle_cli_error("foo/bar", MyUserError("ayy lmao"))
+
+    out, err = capsys.readouterr()
+    assert err.strip() == "critical: ayy lmao"
+
+
+def test_handle_cli_error_ignored(capsys):
+    handle_cli_error("foo/bar", KeyboardInterrupt())
+
+    out, err = capsys.readouterr()
+    assert not err
+
+
 @pytest.mark.asyncio
 async def test_storage_instance_from_config(monkeypatch, aio_connector):
     class Dummy:
@@ -29,3 +63,241 @@ async def test_storage_instance_from_config(monkeypatch, aio_connector):
     config = {"type": "lol", "foo": "bar", "baz": 1}
     storage = await storage_instance_from_config(config, connector=aio_connector)
     assert isinstance(storage, Dummy)
+
+
+def test_save_and_load_status(tmpdir):
+    base_path = str(tmpdir)
+    data = {"collections": [["a", "a", "a"], [None, None, None]], "cache_key": "x"}
+    save_status(base_path, "foobar", "collections", data)
+    assert load_status(base_path, "foobar", data_type="collections") == data
+
+    del data["collections"]
+    data["cache_key"] = "y"
+    save_status(base_path, "foobar", "collections", data)
+    assert load_status(base_path, "foobar", data_type="collections") == data
+    assert tmpdir.join("foobar.collections").stat().mode & 0o777 == 0o600
+
+
+def test_load_legacy_status(tmpdir, capsys):
+    data = {"foo": "bar", "baz": {"qux": 1}}
+    path = tmpdir.join("foobar.metadata")
+    path.write(json.dumps(data))
+    path.chmod(0o600)
+
+    assert load_status(str(tmpdir), "foobar", data_type="metadata") == data
+    # Loading doesn't write, the next save replaces the legacy file.
+    assert path.read_binary().startswith(b"{")
+
+    save_status(str(tmpdir), "foobar", "metadata", data)
+    assert not path.read_binary().startswith(b"{")
+    out, err = capsys.readouterr()
+    assert "Migrating legacy status to sqlite" in err
+    assert "corrupt" not in err
+    assert load_status(str(tmpdir), "foobar", data_type="metadata") == data
+
+
+@pytest.fixture(params=["stdlib", "orjson"])
+def json_backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(utils, "_json_loads", json.loads)
+    else:
+        pytest.importorskip("orjson")
+    return request.param
+
+
+def test_status_json_backends(tmpdir, json_backend):
+    data = {
+        "collections": [["a", "a", "a"], [None, None, None]],
+        "cache_key": "x",
+        "nested": {"ä": [1, 2.5, True]},
+    }
+    save_status(str(tmpdir), "foobar", "collections", data)
+    assert load_status(str(tmpdir), "foobar", data_type="collections") == data
+
+
+def test_status_json_backends_lossless(tmpdir, json_backend):
+    data = {
+        "big": 2**70 + 1,
+        "negative": -(2**63) - 1,
+        "nested": [2**64, "1234567890123456789012"],
+        "nan": float("nan"),
+        "inf": float("-inf"),
+    }
+    save_status(str(tmpdir), "foobar", "metadata", data)
+    loaded = load_status(str(tmpdir), "foobar", data_type="metadata")
+    assert math.isnan(loaded.pop("nan"))
+    assert loaded == {k: v for k, v in data.items() if k != "nan"}
+
+    path = tmpdir.join("foobar.collections")
+    path.write('{"a": NaN, "b": Infinity, "c": 1180591620717411303425}')
+    path.chmod(0o600)
+    loaded = load_status(str(tmpdir), "foobar", data_type="collections")
+    assert math.isnan(loaded.pop("a"))
+    assert loaded == {"b": float("inf"), "c": 2**70 + 1}
+
+
+def test_corrupt_status(tmpdir, capsys):
+    path = tmpdir.join("foobar.collections")
+    path.write('{"collections": [["a"')
+    path.chmod(0o600)
+
+    assert load_status(str(tmpdir), "foobar", data_type="collections") == {}
+
+    data = {"cache_key": "x"}
+    save_status(str(tmpdir), "foobar", "collections", data)
+    assert load_status(str(tmpdir), "foobar", data_type="collections") == data
+    out, err = capsys.readouterr()
+    assert f"Replacing corrupt status file {path}" in err
+    assert path.stat().mode & 0o777 == 0o600
+
+
+def test_status_permissions(tmpdir, monkeypatch):
+    chmods = []
+    real_chmod = os.chmod
+
+    def chmod(path, mode):
+        chmods.append(path)
+        real_chmod(path, mode)
+
+    monkeypatch.setattr(os, "chmod", chmod)
+    path = tmpdir.join("foobar.metadata")
+
+    save_status(str(tmpdir), "foobar", "metadata", {"foo": "bar"})
+    assert path.stat().mode & 0o777 == 0o600
+    assert chmods == []
+
+    for _ in range(3):
+        load_status(str(tmpdir), "foobar", data_type="metadata")
+    save_status(str(tmpdir), "foobar", "metadata", {"foo": "baz"})
+    assert chmods == []
+
+
+def test_save_status_fixes_permissions(tmpdir):
+    # `discover` saves without loading first.
+    save_status(str(tmpdir), "foobar", "collections", {"foo": "bar"})
+    path = tmpdir.join("foobar.collections")
+    path.chmod(0o644)
+
+    save_status(str(tmpdir), "foobar", "collections", {"foo": "baz"})
+    assert path.stat().mode & 0o777 == 0o600
+
+
+@pytest.mark.parametrize("content", [None, "garbage"])
+def test_save_status_never_world_readable(tmpdir, monkeypatch, content):
+    path = tmpdir.join("foobar.metadata")
+    if content is not None:
+        path.write(content)
+        path.chmod(0o600)
+
+    modes = []
+    real_replace = SqliteKeyValueStatus.replace
+
+    def replace(self, data):
+        modes.append(path.stat().mode & 0o777)
+        real_replace(self, data)
+
+    monkeypatch.setattr(SqliteKeyValueStatus, "replace", replace)
+    old_umask = os.umask(0o022)
+    try:
+        save_status(str(tmpdir), "foobar", "metadata", {"foo": "bar"})
+    finally:
+        os.umask(old_umask)
+
+    assert modes and set(modes) == {0o600}
+
+
+def test_load_status_does_not_write(tmpdir):
+    save_status(str(tmpdir), "foobar", "metadata", {"foo": "bar"})
+    path = tmpdir.join("foobar.metadata")
+    content = path.read_binary()
+    mtime = path.mtime()
+
+    assert load_status(str(tmpdir), "foobar", data_type="metadata") == {"foo": "bar"}
+    assert path.read_binary() == content
+    assert path.mtime() == mtime
+    assert tmpdir.listdir() == [path]
+
+
+@pytest.mark.parametrize("content", ["", "{}"])
+def test_load_empty_status(tmpdir, content):
+    path = tmpdir.join("foobar.metadata")
+    path.write(content)
+    path.chmod(0o600)
+
+    assert load_status(str(tmpdir), "foobar", data_type="metadata") == {}
+    assert path.read() == content
+
+
+@pytest.mark.parametrize(
+    "storage_type,requires_connector",
+    [
+        ("caldav", True),
+        ("carddav", True),
+        ("http", True),
+        ("google_calendar", True),
+        ("filesystem", False),
+        ("singlefile", False),
+    ],
+)
+def test_storage_requires_connector(storage_type, requires_connector):
+    assert storage_names[storage_type].requires_connector is requires_connector
+
+
+def test_get_status_path_legacy_items(tmpdir):
+    tmpdir.join("foobar").write("{}")
+    path = get_status_path(str(tmpdir), "foobar", data_type="items")
+    assert path == str(tmpdir.join("foobar.items"))
+    assert tmpdir.join("foobar.items").read() == "{}"
+    assert not tmpdir.join("foobar").check()
+
+
+def test_get_status_path_checks_legacy_once(tmpdir, monkeypatch):
+    checked = []
+    real_isfile = os.path.isfile
+
+    def isfile(path):
+        checked.append(path)
+        return real_isfile(path)
+
+    monkeypatch.setattr(os.path, "isfile", isfile)
+
+    for data_type in ("metadata", "collections"):
+        get_status_path(str(tmpdir), "foobar", "a", data_type=data_type)
+    assert checked == []
+
+    for _ in range(3):
+        get_status_path(str(tmpdir), "foobar", "a", data_type="items")
+        get_status_path(str(tmpdir), "foobar", "b", data_type="items")
+    assert checked == [
+        str(tmpdir.join("foobar", "a")),
+        str(tmpdir.join("foobar", "b")),
+    ]
+
+    # A legacy file that shows up later isn't looked for again.
+    tmpdir.join("foobar", "a").write("{}", ensure=True)
+    path = get_status_path(str(tmpdir), "foobar", "a", data_type="items")
+    assert path == str(tmpdir.join("foobar", "a.items"))
+    assert tmpdir.join("foobar", "a").check()
+    assert len(checked) == 2
+
+
+def test_manage_sync_status_legacy(tmpdir):
+    path = tmpdir.join("foobar").join("a.items")
+    path.write(
+        json.dumps(
+            {
+                "ident": [
+                    {"href": "a.txt", "hash": "x", "etag": "1"},
+                    {"href": "b.txt", "hash": "x", "etag": "2"},
+                ]
+            }
+        ),
+        ensure=True,
+    )
+
+    with manage_sync_status(str(tmpdir), "foobar", "a") as status:
+        assert status.get_a("ident").href == "a.txt"
+        assert status.get_b("ident").etag == "2"
+
+    with manage_sync_status(str(tmpdir), "foobar", "a") as status:
+        assert status.get_a("ident").href == "a.txt"
@@ -21,9 +21,12 @@ def no_debug_output(request):
 def test_get_storage_init_args():
     from vdirsyncer.storage.memory import MemoryStorage
 
-    all, required = utils.get_storage_init_args(MemoryStorage)
+    rv = utils.get_storage_init_args(MemoryStorage)
+    all, required = rv
     assert all == {"fileext", "collection", "read_only", "instance_name", "no_delete"}
     assert not required
+    # Cached per class
+    assert utils.get_storage_init_args(MemoryStorage) is rv
 
 
 @pytest.mark.asyncio
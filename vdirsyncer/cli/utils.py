@@ -1,37 +1,76 @@
 from __future__ import annotations
 
 import contextlib
-import errno
+import functools
 import importlib
 import json
 import os
+import re
+import sqlite3
 import sys
+from typing import TYPE_CHECKING
 from typing import Any
+from typing import Callable
 
-import aiohttp
 import click
 
 from .. import BUGTRACKER_HOME
 from .. import DOCS_HOME
 from .. import exceptions
-from ..storage.base import Storage
 from ..sync.exceptions import IdentConflict
 from ..sync.exceptions import PartialSync
 from ..sync.exceptions import StorageEmpty
 from ..sync.exceptions import SyncConflict
+from ..sync.status import SqliteKeyValueStatus
 from ..sync.status import SqliteStatus
-from ..utils import atomic_write
 from ..utils import expand_path
 from ..utils import get_storage_init_args
 from . import cli_logger
 
+if TYPE_CHECKING:
+    import aiohttp
+
+    from ..storage.base import Storage
+
+
+def _json_dumps(obj: Any) -> str:
+    # Always the stdlib: orjson would silently write NaN as null. Only a few
+    # small values are serialized per save, parsing is what is worth speeding
+    # up.
+    return json.dumps(obj, separators=(",", ":"))
+
+
+try:
+    import orjson
+except ImportError:
+    _json_loads: Callable[[str], Any] = json.loads
+else:
+    # orjson parses integers beyond 64 bits as floats, those are the only
+    # numbers with 19 digits or more that it doesn't round-trip.
+    _long_number_re = re.compile(r"\d{19}")
+
+    def _json_loads(s: str) -> Any:
+        if _long_number_re.search(s) is None:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # NaN and Infinity, which the stdlib accepts.
+                pass
+        return json.loads(s)
+
+
 STATUS_PERMISSIONS = 0o600
 STATUS_DIR_PERMISSIONS = 0o700
 
+# Status paths (without data type suffix) that have already been checked for
+# legacy item status files, so that happens at most once per process.
+_checked_legacy_status_paths: set[str] = set()
+
 
 class _StorageIndex:
     def __init__(self):
-        self._storages: dict[str, str] = {
+        # Dotted paths are replaced by the class once it has been imported.
+        self._storages: dict[str, type[Storage] | str] = {
             "caldav": "vdirsyncer.storage.dav.CalDAVStorage",
             "carddav": "vdirsyncer.storage.dav.CardDAVStorage",
             "filesystem": "vdirsyncer.storage.filesystem.FilesystemStorage",
@@ -41,10 +80,11 @@ class _StorageIndex:
             "google_contacts": "vdirsyncer.storage.google.GoogleContactsStorage",
         }
 
-    def __getitem__(self, name: str) -> Storage:
+    def __getitem__(self, name: str) -> type[Storage]:
         item = self._storages[name]
-        if not isinstance(item, str):
-            return item
+        # Cheaper than isinstance() on the common, already imported path.
+        if type(item) is not str:  # noqa: E721
+            return item  # type: ignore[return-value]
 
         modname, clsname = item.rsplit(".", 1)
         mod = importlib.import_module(modname)
@@ -61,6 +101,146 @@ class JobFailed(RuntimeError):
     pass
 
 
+_STORAGE_EMPTY_MSG = (
+    '{status_name}: Storage "{name}" was completely emptied. If you '
+    "want to delete ALL entries on BOTH sides, then use "
+    "`vdirsyncer sync --force-delete {status_name}`. "
+    "Otherwise delete the files for {status_name} in your status "
+    "directory."
+)
+
+_PARTIAL_SYNC_MSG = (
+    "{status_name}: Attempted change on {storage}, which is read-only"
+    ". Set `partial_sync` in your pair section to `ignore` to ignore "
+    "those changes, or `revert` to revert them on the other side."
+)
+
+_SYNC_CONFLICT_MSG = (
+    "{status_name}: One item changed on both sides. Resolve this "
+    "conflict manually, or by setting the `conflict_resolution` "
+    "parameter in your config file.\n"
+    f"See also {DOCS_HOME}/config.html#pair-section\n"
+    "Item ID: {ident}\n"
+    "Item href on side A: {href_a}\n"
+    "Item href on side B: {href_b}\n"
+)
+
+_IDENT_CONFLICT_MSG = (
+    '{status_name}: Storage "{storage.instance_name}" contains '
+    "multiple items with the same UID or even content. Vdirsyncer "
+    "will now abort the synchronization of this collection, because "
+    "the fix for this is not clear; It could be the result of a badly "
+    "behaving server. You can try running:\n\n"
+    "    vdirsyncer repair {storage.instance_name}\n\n"
+    "But make sure to have a backup of your data in some form. The "
+    "offending hrefs are:\n\n{href_list}\n"
+)
+
+_PAIR_NOT_FOUND_MSG = (
+    "Pair {pair_name} does not exist. Please check your "
+    "configuration file and make sure you've typed the pair name "
+    "correctly"
+)
+
+_INVALID_RESPONSE_MSG = (
+    "The server returned something vdirsyncer doesn't understand. "
+    "Error message: {error!r}\n"
+    "While this is most likely a serverside problem, the vdirsyncer "
+    "devs are generally interested in such bugs. Please report it in "
+    f"the issue tracker at {BUGTRACKER_HOME}"
+)
+
+_COLLECTION_REQUIRED_MSG = (
+    "One or more storages don't support `collections = null`. "
+    'You probably want to set `collections = ["from a", "from b"]`.'
+)
+
+
+def _handle_user_error(e, status_name):
+    cli_logger.critical(e)
+
+
+def _handle_storage_empty(e, status_name):
+    cli_logger.error(
+        _STORAGE_EMPTY_MSG.format(
+            name=e.empty_storage.instance_name, status_name=status_name
+        )
+    )
+
+
+def _handle_partial_sync(e, status_name):
+    cli_logger.error(
+        _PARTIAL_SYNC_MSG.format(status_name=status_name, storage=e.storage)
+    )
+
+
+def _handle_sync_conflict(e, status_name):
+    cli_logger.error(
+        _SYNC_CONFLICT_MSG.format(
+            status_name=status_name, ident=e.ident, href_a=e.href_a, href_b=e.href_b
+        )
+    )
+
+
+def _handle_ident_conflict(e, status_name):
+    cli_logger.error(
+        _IDENT_CONFLICT_MSG.format(
+            status_name=status_name,
+            storage=e.storage,
+            href_list="\n".join(map(repr, e.hrefs)),
+        )
+    )
+
+
+def _handle_pair_not_found(e, status_name):
+    cli_logger.error(_PAIR_NOT_FOUND_MSG.format(pair_name=e.pair_name))
+
+
+def _handle_invalid_response(e, status_name):
+    cli_logger.error(_INVALID_RESPONSE_MSG.format(error=e))
+
+
+def _handle_collection_required(e, status_name):
+    cli_logger.error(_COLLECTION_REQUIRED_MSG)
+
+
+def _handle_unknown_error(e, status_name):
+    import traceback
+
+    tb = traceback.format_tb(e.__traceback__)
+    if status_name:
+        msg = f"Unknown error occurred for {status_name}"
+    else:
+        msg = "Unknown error occurred"
+
+    msg += f": {e}\nUse `-vdebug` to see the full traceback."
+
+    cli_logger.error(msg)
+    cli_logger.debug("".join(tb))
+
+
+def _ignore_error(e, status_name):
+    pass
+
+
+# Maps exception types to the function printing a message for them. Lookup
+# walks the MRO of the raised exception, so subclasses are handled too.
+_ERROR_HANDLERS: dict[type[BaseException], Callable[[Any, str | None], None]] = {
+    exceptions.UserError: _handle_user_error,
+    StorageEmpty: _handle_storage_empty,
+    PartialSync: _handle_partial_sync,
+    SyncConflict: _handle_sync_conflict,
+    IdentConflict: _handle_ident_conflict,
+    click.Abort: _ignore_error,
+    KeyboardInterrupt: _ignore_error,
+    JobFailed: _ignore_error,
+    exceptions.PairNotFound: _handle_pair_not_found,
+    exceptions.InvalidResponse: _handle_invalid_response,
+    exceptions.CollectionRequired: _handle_collection_required,
+    Exception: _handle_unknown_error,
+}
+
+
 def handle_cli_error(status_name=None, e=None):
     """
     Print a useful error message for the current exception.
@@ -69,89 +249,18 @@ def handle_cli_error(status_name=None, e=None):
     exceptions itself.
     """
 
-    try:
-        if e is not None:
-            raise e
-        else:
-            raise
-    except exceptions.UserError as e:
-        cli_logger.critical(e)
-    except StorageEmpty as e:
-        cli_logger.error(
-            '{status_name}: Storage "{name}" was completely emptied. If you '
-            "want to delete ALL entries on BOTH sides, then use "
-            "`vdirsyncer sync --force-delete {status_name}`. "
-            "Otherwise delete the files for {status_name} in your status "
-            "directory.".format(
-                name=e.empty_storage.instance_name, status_name=status_name
-            )
-        )
-    except PartialSync as e:
-        cli_logger.error(
-            f"{status_name}: Attempted change on {e.storage}, which is read-only"
-            ". Set `partial_sync` in your pair section to `ignore` to ignore "
-            "those changes, or `revert` to revert them on the other side."
-        )
-    except SyncConflict as e:
-        cli_logger.error(
-            f"{status_name}: One item changed on both sides. Resolve this "
-            "conflict manually, or by setting the `conflict_resolution` "
-            "parameter in your config file.\n"
-            f"See also {DOCS_HOME}/config.html#pair-section\n"
-            f"Item ID: {e.ident}\n"
-            f"Item href on side A: {e.href_a}\n"
-            f"Item href on side B: {e.href_b}\n"
-        )
-    except IdentConflict as e:
-        cli_logger.error(
-            '{status_name}: Storage "{storage.instance_name}" contains '
-            "multiple items with the same UID or even content. Vdirsyncer "
-            "will now abort the synchronization of this collection, because "
-            "the fix for this is not clear; It could be the result of a badly "
-            "behaving server. You can try running:\n\n"
-            "    vdirsyncer repair {storage.instance_name}\n\n"
-            "But make sure to have a backup of your data in some form. The "
-            "offending hrefs are:\n\n{href_list}\n".format(
-                status_name=status_name,
-                storage=e.storage,
-                href_list="\n".join(map(repr, e.hrefs)),
-            )
-        )
-    except (click.Abort, KeyboardInterrupt, JobFailed):
-        pass
-    except exceptions.PairNotFound as e:
-        cli_logger.error(
-            f"Pair {e.pair_name} does not exist. Please check your "
-            "configuration file and make sure you've typed the pair name "
-            "correctly"
-        )
-    except exceptions.InvalidResponse as e:
-        cli_logger.error(
-            "The server returned something vdirsyncer doesn't understand. "
-            f"Error message: {e!r}\n"
-            "While this is most likely a serverside problem, the vdirsyncer "
-            "devs are generally interested in such bugs. Please report it in "
-            f"the issue tracker at {BUGTRACKER_HOME}"
-        )
-    except exceptions.CollectionRequired:
-        cli_logger.error(
-            "One or more storages don't support `collections = null`. "
-            'You probably want to set `collections = ["from a", "from b"]`.'
-        )
-    except Exception as e:
-        tb = sys.exc_info()[2]
-        import traceback
-
-        tb = traceback.format_tb(tb)
-        if status_name:
-            msg = f"Unknown error occurred for {status_name}"
-        else:
-            msg = "Unknown error occurred"
+    if e is None:
+        e = sys.exc_info()[1]
 
-        msg += f": {e}\nUse `-vdebug` to see the full traceback."
+    for cls in type(e).__mro__:
+        handler = _ERROR_HANDLERS.get(cls)
+        if handler is not None:
+            handler(e, status_name)
+            return
 
-        cli_logger.error(msg)
-        cli_logger.debug("".join(tb))
+    # Neither an Exception nor one of the ignored BaseExceptions (e.g.
+    # SystemExit), let it propagate.
+    raise e
 
 
 def get_status_name(pair: str, collection: str | None) -> str:
@@ -169,11 +278,13 @@ def get_status_path(
     assert data_type is not None
     status_name = get_status_name(pair, collection)
     path = expand_path(os.path.join(base_path, status_name))
-    if os.path.isfile(path) and data_type == "items":
-        new_path = path + ".items"
-        # XXX: Legacy migration
-        cli_logger.warning(f"Migrating statuses: Renaming {path} to {new_path}")
-        os.rename(path, new_path)
+    if data_type == "items" and path not in _checked_legacy_status_paths:
+        if os.path.isfile(path):
+            new_path = path + ".items"
+            # XXX: Legacy migration
+            cli_logger.warning(f"Migrating statuses: Renaming {path} to {new_path}")
+            os.rename(path, new_path)
+        _checked_legacy_status_paths.add(path)
 
     path += "." + data_type
     return path
@@ -186,51 +297,76 @@ def load_status(
     data_type: str | None = None,
 ) -> dict[str, Any]:
     path = get_status_path(base_path, pair, collection, data_type)
-    if not os.path.exists(path):
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return {}
+    _assert_permissions_once(path, STATUS_PERMISSIONS)
+
+    # An empty file or an empty legacy status (`{}`). A SQLite database is
+    # never this small, so there is nothing to parse.
+    if size <= 2:
         return {}
-    assert_permissions(path, STATUS_PERMISSIONS)
 
-    with open(path) as f:
+    with contextlib.closing(SqliteKeyValueStatus(path)) as status:
         try:
-            return dict(json.load(f))
-        except ValueError:
-            pass
+            items = status.items()
+        except sqlite3.OperationalError:
+            raise
+        except sqlite3.DatabaseError:
+            # Not a database, so this is either a legacy JSON status or
+            # garbage. The next save_status replaces it either way.
+            return _load_legacy_status(path) or {}
 
-    return {}
+    return {key: _json_loads(value) for key, value in items}
 
 
 def prepare_status_path(path: str) -> None:
-    dirname = os.path.dirname(path)
+    os.makedirs(os.path.dirname(path), STATUS_DIR_PERMISSIONS, exist_ok=True)
+
 
+def _create_status_file(path: str) -> bool:
+    """Create an empty status file that is only accessible to the user, unless
+    it exists already.
+
+    :returns: Whether the file has been created.
+    """
     try:
-        os.makedirs(dirname, STATUS_DIR_PERMISSIONS)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+        os.close(
+            os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, STATUS_PERMISSIONS)
+        )
+    except FileExistsError:
+        return False
+    return True
 
 
-@contextlib.contextmanager
-def manage_sync_status(base_path: str, pair_name: str, collection_name: str):
-    path = get_status_path(base_path, pair_name, collection_name, "items")
-    status = None
-    legacy_status = None
+def _load_legacy_status(path: str) -> dict[str, Any] | None:
+    # XXX: Legacy migration
     try:
-        # XXX: Legacy migration
         with open(path, "rb") as f:
             if f.read(1) == b"{":
                 f.seek(0)
-                legacy_status = dict(json.load(f))
+                return _json_loads(f.read().decode())
     except (OSError, ValueError):
         pass
+    return None
+
 
-    if legacy_status is not None:
+@contextlib.contextmanager
+def manage_sync_status(base_path: str, pair_name: str, collection_name: str):
+    path = get_status_path(base_path, pair_name, collection_name, "items")
+    prepare_status_path(path)
+    try:
+        status = SqliteStatus(path)
+    except sqlite3.DatabaseError:
+        # Not a database, so this is either a legacy JSON status or garbage.
+        legacy_status = _load_legacy_status(path)
+        if legacy_status is None:
+            raise
         cli_logger.warning("Migrating legacy status to sqlite")
         os.remove(path)
         status = SqliteStatus(path)
         status.load_legacy_status(legacy_status)
-    else:
-        prepare_status_path(path)
-        status = SqliteStatus(path)
 
     yield status
 
@@ -242,24 +378,42 @@ def save_status(
     data: dict[str, Any],
     collection: str | None = None,
 ) -> None:
-    status_name = get_status_name(pair, collection)
-    path = expand_path(os.path.join(base_path, status_name)) + "." + data_type
+    path = get_status_path(base_path, pair, collection, data_type)
     prepare_status_path(path)
+    serialized = {key: _json_dumps(value) for key, value in data.items()}
 
-    with atomic_write(path, mode="w", overwrite=True) as f:
-        json.dump(data, f)
-
-    os.chmod(path, STATUS_PERMISSIONS)
+    # Create the file ourselves, SQLite would use the umask and write the data
+    # before we could fix the permissions.
+    if not _create_status_file(path):
+        _assert_permissions_once(path, STATUS_PERMISSIONS)
+    status = SqliteKeyValueStatus(path)
+    try:
+        status.replace(serialized)
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError:
+        # A legacy JSON status or garbage. All data is being replaced anyway,
+        # so there is nothing to migrate.
+        status.close()
+        if _load_legacy_status(path) is not None:
+            cli_logger.warning("Migrating legacy status to sqlite")
+        else:
+            cli_logger.warning(f"Replacing corrupt status file {path}")
+        os.remove(path)
+        _create_status_file(path)
+        status = SqliteKeyValueStatus(path)
+        status.replace(serialized)
+    finally:
+        status.close()
 
 
 def storage_class_from_config(config):
-    config = dict(config)
-    storage_name = config.pop("type")
+    storage_name = config["type"]
     try:
         cls = storage_names[storage_name]
     except KeyError:
         raise exceptions.UserError(f"Unknown storage type: {storage_name}")
-    return cls, config
+    return cls, {k: v for k, v in config.items() if k != "type"}
 
 
 async def storage_instance_from_config(
@@ -272,12 +426,9 @@ async def storage_instance_from_config(
     :param config: A configuration dictionary to pass as kwargs to the class
         corresponding to config['type']
     """
-    from vdirsyncer.storage.dav import DAVStorage
-    from vdirsyncer.storage.http import HttpStorage
-
     cls, new_config = storage_class_from_config(config)
 
-    if issubclass(cls, DAVStorage) or issubclass(cls, HttpStorage):
+    if getattr(cls, "requires_connector", False):
         assert connector is not None  # FIXME: hack?
         new_config["connector"] = connector
 
@@ -342,12 +493,19 @@ def assert_permissions(path: str, wanted: int) -> None:
         os.chmod(path, wanted)
 
 
+@functools.lru_cache(maxsize=None)
+def _assert_permissions_once(path: str, wanted: int) -> None:
+    assert_permissions(path, wanted)
+
+
 async def handle_collection_not_found(config, collection, e=None):
     storage_name = config.get("instance_name", None)
+    # Quote like the config file would, without going through the JSON encoder.
+    collection_repr = "null" if collection is None else f'"{collection}"'
 
     cli_logger.warning(
         "{}No collection {} found for storage {}.".format(
-            f"{e}\n" if e else "", json.dumps(collection), storage_name
+            f"{e}\n" if e else "", collection_repr, storage_name
         )
     )
 
@@ -75,6 +75,10 @@ class Storage(metaclass=StorageMeta):
     # support those methods.
     read_only = False
 
+    # A value of True means the storage talks HTTP and has to be passed the
+    # shared aiohttp ``connector`` when it is instantiated.
+    requires_connector = False
+
     # The attribute values to show in the representation of the storage.
     _repr_attributes: list[str] = []
 
@@ -454,6 +454,7 @@ class DAVStorage(Storage):
     # The DAVSession class to use
     session_class = DAVSession
 
+    requires_connector = True
     connector: aiohttp.TCPConnector
 
     _repr_attributes = ["username", "url"]
@@ -22,6 +22,7 @@ logger = logging.getLogger(__name__)
 class HttpStorage(Storage):
     storage_name = "http"
     read_only = True
+    requires_connector = True
     _repr_attributes = ["username", "url"]
     _items = None
 
@@ -348,6 +348,76 @@ class SubStatus:
             self.get_by_href = parent.get_by_href_b
 
 
+class SqliteKeyValueStatus:
+    """
+    Status storage for everything that isn't item data (e.g. the collections
+    cache or metasync state). Values are opaque strings, serialization is up
+    to the caller.
+
+    Reading never writes to the database, the schema is only created by
+    :py:meth:`replace`.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path=":memory:"):
+        self._path = path
+        self._c = sqlite3.connect(path)
+        self._c.isolation_level = None  # turn off idiocy of DB-API
+
+    def _update_schema(self):
+        if self._is_latest_version():
+            return
+
+        # If we ever bump the schema version, we will need a way to migrate
+        # data.
+        with _exclusive_transaction(self._c) as c:
+            c.execute('CREATE TABLE meta ( "version" INTEGER PRIMARY KEY )')
+            c.execute("INSERT INTO meta (version) VALUES (?)", (self.SCHEMA_VERSION,))
+            c.execute(
+                """CREATE TABLE status (
+                "key" TEXT PRIMARY KEY NOT NULL,
+                "value" TEXT NOT NULL
+            ); """
+            )
+
+    def _is_latest_version(self):
+        try:
+            return bool(
+                self._c.execute(
+                    "SELECT version FROM meta WHERE version = ?", (self.SCHEMA_VERSION,)
+                ).fetchone()
+            )
+        except sqlite3.OperationalError:
+            return False
+
+    def items(self):
+        """
+        :raises sqlite3.DatabaseError: If the file is not a database.
+        """
+        if not self._is_latest_version():
+            return []
+        return self._c.execute("SELECT key, value FROM status").fetchall()
+
+    def replace(self, data):
+        """Replace the stored mapping with ``data``, touching only the rows
+        that are affected."""
+        self._update_schema()
+        with _exclusive_transaction(self._c) as c:
+            old = dict(c.execute("SELECT key, value FROM status").fetchall())
+            c.executemany(
+                "DELETE FROM status WHERE key = ?",
+                [(key,) for key in old if key not in data],
+            )
+            c.executemany(
+                "INSERT OR REPLACE INTO status (key, value) VALUES (?, ?)",
+                [(key, value) for key, value in data.items() if old.get(key) != value],
+            )
+
+    def close(self):
+        self._c.close()
+
+
 class ItemMetadata:
     href = None
     hash = None
@@ -91,15 +91,18 @@ def get_storage_init_specs(cls, stop_at=object):
     return (spec,) + superspecs
 
 
+@functools.lru_cache(maxsize=None)
 def get_storage_init_args(cls, stop_at=object):
     """
     Get args which are taken during class initialization. Assumes that all
     classes' __init__ calls super().__init__ with the rest of the arguments.
 
+    The result is cached per class, which is why frozensets are returned.
+
     :param cls: The class to inspect.
-    :returns: (all, required), where ``all`` is a set of all arguments the
-        class can take, and ``required`` is the subset of arguments the class
-        requires.
+    :returns: (all, required), where ``all`` is a frozenset of all arguments
+        the class can take, and ``required`` is the subset of arguments the
+        class requires.
     """
     all, required = set(), set()
     for spec in get_storage_init_specs(cls, stop_at=stop_at):
@@ -107,7 +110,7 @@ def get_storage_init_args(cls, stop_at=object):
         last = -len(spec.defaults) if spec.defaults else len(spec.args)
         required.update(spec.args[1:last])
 
-    return all, required
+    return frozenset(all), frozenset(required)
 
 
 def checkdir(path: str, create: bool = False, mode: int = 0o750) -> None: